@@ -1,4 +1,7 @@
 from .manifold import Manifold
+from .spatial import SphereIndex
+from .fields import GriddedField
+from .neighbors import PairInteraction, VerletList, soft_repulsion, verlet_skin
 #from brownian_manifold.diffusion import Diffusion
 from .utils import *
 __version__ = '0.1.dev'
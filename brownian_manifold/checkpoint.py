@@ -0,0 +1,154 @@
+"""
+Checkpointing helpers for long running brownian-manifold simulations
+"""
+
+import os
+import threading
+
+import numpy as np
+
+
+def save_checkpoint(path, state):
+    """
+    Write a checkpoint to disk.
+
+    The file is first written next to its final location and then moved
+    into place, so an interrupted write never clobbers the previous
+    checkpoint.
+
+    Parameters
+    ----------
+    path: str, location of the checkpoint file
+
+    state: dict, arrays/scalars to be stored (see 'walker_state')
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **state)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by 'save_checkpoint'.
+
+    Parameters
+    ----------
+    path: str, location of the checkpoint file
+
+    Returns
+    -------
+    state: dict, the stored arrays/scalars
+    """
+    with np.load(path, allow_pickle=False) as data:
+        state = dict((key, data[key]) for key in data.files)
+    return state
+
+
+def walker_state(manifold, step, positions, rng_state):
+    """
+    helper to pack the state of a walker on the 2-sphere
+    into a dict that can be handed to 'save_checkpoint'
+
+    Parameters
+    ----------
+    manifold: Manifold, the object running the simulation
+
+    step: int, index of the next step to be taken
+
+    positions: array, 3 x (step + 1), the walk so far in the current frame
+
+    rng_state: tuple, 'RandomState.get_state()' taken before the
+               tangent plane steps were drawn (MT19937 generator only)
+
+    Returns
+    -------
+    state: dict
+    """
+    return dict(manifold=manifold.manifold,
+                radius_sphere=manifold.radius_sphere,
+                final_time=manifold.final_time,
+                n_steps=manifold.n_steps,
+                step=step,
+                positions=positions,
+                rng_name=rng_state[0],
+                rng_keys=rng_state[1],
+                rng_pos=rng_state[2],
+                rng_has_gauss=rng_state[3],
+                rng_cached_gaussian=rng_state[4])
+
+
+def rng_state_from(state):
+    """
+    helper to rebuild the 'RandomState.set_state()' tuple
+    stored by 'walker_state'
+    """
+    return (str(state['rng_name']),
+            state['rng_keys'],
+            int(state['rng_pos']),
+            int(state['rng_has_gauss']),
+            float(state['rng_cached_gaussian']))
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread so that the simulation
+    does not wait on the disk.
+
+    Only the most recent state is kept: if a new state is submitted
+    while the previous one is still being written, the older pending
+    state is dropped. Submitted arrays must not be modified afterwards.
+
+    Parameters
+    ----------
+    path: str, location of the checkpoint file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = None
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                state, self._pending = self._pending, None
+                if state is None:
+                    return
+            try:
+                save_checkpoint(self.path, state)
+            except Exception as err:
+                with self._cond:
+                    self._error = err
+                    return
+
+    def submit(self, state):
+        """Queue a state to be written (does not block on the disk)"""
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            self._pending = state
+            self._cond.notify()
+
+    def close(self, raise_error=True):
+        """
+        Flush the pending state and stop the writer thread
+
+        Parameters
+        ----------
+        raise_error: bool, if True then re-raise the error (if any)
+                     that stopped the writer thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if raise_error and self._error is not None:
+            raise self._error
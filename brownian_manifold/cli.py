@@ -0,0 +1,344 @@
+"""
+Command-line batch runner for parameter sweeps of brownian-manifold
+simulations.
+
+A sweep manifest is a JSON file such as
+
+    {
+        "output_dir": "sweep_output",
+        "defaults": {"manifold": "sphere", "final_time": 1,
+                     "n_steps": 1000, "n_particles": 4, "seed": 0},
+        "sweep": {"radius_sphere": [1, 2], "n_steps": [1000, 10000]},
+        "jobs": [{"radius_sphere": 5, "seed": 7}]
+    }
+
+Every combination of the "sweep" values and every entry of "jobs" is a
+job (on top of the "defaults"). Each job gets its own directory in the
+output directory, holding one trajectory per particle and a summary.json
+written once the job is complete. Completed jobs (and particles) are
+skipped when the manifest is run again.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import matplotlib
+# the runner never plots: avoid requiring a display on batch nodes
+matplotlib.use('Agg')
+import numpy as np
+
+from brownian_manifold.manifold import Manifold
+
+
+# parameters of a job, with their defaults and types (the cylinder
+# parameters are left out until Manifold has a cylinder walk)
+JOB_DEFAULTS = dict(manifold='sphere',
+                    radius_sphere=1.,
+                    final_time=1.,
+                    n_steps=1000,
+                    n_particles=1,
+                    seed=0)
+
+
+def expand_manifest(manifest):
+    """
+    helper to turn a sweep manifest into the list of its jobs
+
+    Parameters
+    ----------
+    manifest: dict, the parsed manifest (see module docstring)
+
+    Returns
+    -------
+    jobs: list of dicts, the parameters of each job (without duplicates)
+    """
+    defaults = dict(JOB_DEFAULTS)
+    defaults.update(manifest.get('defaults', {}))
+
+    overrides = []
+    sweep = manifest.get('sweep', {})
+    if sweep:
+        names = sorted(sweep)
+        for values in itertools.product(*[sweep[name] for name in names]):
+            overrides.append(dict(zip(names, values)))
+    overrides.extend(manifest.get('jobs', []))
+    if not overrides:
+        overrides = [{}]
+
+    jobs = []
+    for override in overrides:
+        params = dict(defaults)
+        params.update(override)
+        unknown = set(params) - set(JOB_DEFAULTS)
+        if unknown:
+            raise ValueError('{0} are not recognized job\n\
+            parameters!'.format(sorted(unknown)))
+        if params['manifold'] != 'sphere':
+            raise ValueError('the batch runner only simulates the sphere\n\
+            manifold, not {0}!'.format(params['manifold']))
+        # same type as the defaults, so that e.g. 1 and 1.0 are one job
+        for name, default in JOB_DEFAULTS.items():
+            if name != 'manifold':
+                params[name] = _check_number(name, params[name],
+                                             type(default))
+        for name in ('radius_sphere', 'final_time', 'n_steps',
+                     'n_particles'):
+            if params[name] <= 0:
+                raise ValueError('{0} must be positive, not\n\
+                {1}!'.format(name, params[name]))
+        if params not in jobs:
+            jobs.append(params)
+    return jobs
+
+
+def _check_number(name, value, kind):
+    """
+    helper to convert a job parameter to 'kind' (int or float),
+    refusing values that would be truncated (e.g. n_steps = 1000.7)
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('{0} must be a number, not\n\
+        {1!r}!'.format(name, value))
+    if kind is int and value != int(value):
+        raise ValueError('{0} must be an integer, not\n\
+        {1!r}!'.format(name, value))
+    return kind(value)
+
+
+def job_id(params):
+    """helper to name a job after a hash of its parameters"""
+    key = json.dumps(params, sort_keys=True).encode('utf-8')
+    return 'job_' + hashlib.sha1(key).hexdigest()[:12]
+
+
+def _write_json(path, data):
+    """helper to write a json file without leaving a partial file behind"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def summarize(trajectories, radius, step_size):
+    """
+    Summary statistics of the trajectories of a job
+
+    'simulate_brownian_sphere' returns each trajectory in its own frame
+    (the one where the last step sits at the north pole), so only
+    statistics that do not depend on the frame are reported, averaged
+    over the particles:
+
+    mean_step_angle: mean angle (radians) between consecutive steps
+
+    mean_displacement_angle: mean angle between the first and the last
+    step of a trajectory
+
+    mean_cos_displacement: mean cosine of that angle, to be compared
+    with 'expected_cos_displacement' = exp(-t/radius**2), its value for
+    Brownian motion on the sphere after the time t between the first
+    and the last step
+
+    start_hemisphere_fraction: fraction of the steps within pi/2 of the
+    first step (tends to 0.5 as the walk covers the sphere uniformly)
+
+    Parameters
+    ----------
+    trajectories: list of arrays, n_steps x 3
+
+    radius: float, radius of the sphere
+
+    step_size: float, time between two steps
+
+    Returns
+    -------
+    stats: dict
+    """
+    step_angles = []
+    cos_displacement = []
+    start_hemisphere = []
+    for browniansphere in trajectories:
+        cos_step = np.sum(browniansphere[1:]*browniansphere[:-1],
+                          axis=1)/radius**2
+        step_angles.append(np.arccos(np.clip(cos_step, -1, 1)))
+        cos_start = np.dot(browniansphere, browniansphere[0])/radius**2
+        cos_displacement.append(np.clip(cos_start[-1], -1, 1))
+        start_hemisphere.append(np.mean(cos_start >= 0))
+    cos_displacement = np.array(cos_displacement)
+    elapsed_time = (len(trajectories[0]) - 1)*step_size
+    return dict(mean_step_angle=float(np.concatenate(step_angles).mean()),
+                mean_displacement_angle=float(
+                                np.arccos(cos_displacement).mean()),
+                mean_cos_displacement=float(cos_displacement.mean()),
+                expected_cos_displacement=float(
+                                np.exp(-elapsed_time/radius**2)),
+                start_hemisphere_fraction=float(np.mean(start_hemisphere)))
+
+
+def run_job(params, job_dir, checkpoint_every=None):
+    """
+    Run the simulations of one job in 'job_dir'
+
+    Particles with a saved trajectory are skipped, a particle with a
+    checkpoint is resumed from it.
+
+    Parameters
+    ----------
+    params: dict, the job parameters (see 'expand_manifest')
+
+    job_dir: str, output directory of the job
+
+    checkpoint_every: int, number of steps between checkpoints
+                      (None: no checkpoints)
+
+    Returns
+    -------
+    summary: dict, the content of the job's summary.json
+    """
+    if not os.path.isdir(job_dir):
+        os.makedirs(job_dir)
+
+    trajectories = []
+    steps_run = 0
+    elapsed = 0.0
+    for k in range(params['n_particles']):
+        path = os.path.join(job_dir, 'particle_{0:04d}.npy'.format(k))
+        if os.path.exists(path):
+            trajectories.append(np.load(path))
+            continue
+        checkpoint_path = os.path.join(job_dir,
+                                       'particle_{0:04d}.ckpt'.format(k))
+        manifold = Manifold(manifold=params['manifold'],
+                            radius_sphere=params['radius_sphere'],
+                            final_time=params['final_time'],
+                            n_steps=params['n_steps'],
+                            plt_interactive=False,
+                            random_state=[params['seed'], k])
+        start = time.time()
+        if os.path.exists(checkpoint_path):
+            browniansphere = manifold.resume(
+                                    checkpoint_path,
+                                    checkpoint_every=checkpoint_every)
+        else:
+            browniansphere = manifold.simulate_brownian_sphere(
+                                    checkpoint_path=checkpoint_path,
+                                    checkpoint_every=checkpoint_every)
+        elapsed += time.time() - start
+        # a resumed particle only ran the steps after its checkpoint
+        steps_run += manifold.n_steps - manifold.start_step_
+
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, browniansphere)
+        os.replace(path + '.tmp', path)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        trajectories.append(browniansphere)
+
+    summary = dict(job_id=os.path.basename(job_dir),
+                   params=params,
+                   steps_run=steps_run,
+                   elapsed=elapsed,
+                   steps_per_sec=steps_run/elapsed if elapsed > 0 else None,
+                   stats=summarize(trajectories, params['radius_sphere'],
+                                   params['final_time']/params['n_steps']))
+    _write_json(os.path.join(job_dir, 'summary.json'), summary)
+    return summary
+
+
+def _run_job_star(args):
+    """helper for the process pool: run a job and catch its failure"""
+    params, job_dir, checkpoint_every = args
+    try:
+        return job_dir, run_job(params, job_dir, checkpoint_every), None
+    except Exception as err:
+        return job_dir, None, '{0}: {1}'.format(err.__class__.__name__, err)
+
+
+def main(argv=None):
+    """Entry point of the 'brownian-manifold' console script"""
+    parser = argparse.ArgumentParser(
+        prog='brownian-manifold',
+        description='Run a parameter sweep of Brownian motion simulations '
+                    'described by a JSON manifest.')
+    parser.add_argument('manifest', help='path to the sweep manifest')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='output directory (overrides the manifest '
+                             '"output_dir", default: brownian_output)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes '
+                             '(default: number of cores)')
+    parser.add_argument('--checkpoint-every', type=int, default=None,
+                        help='steps between checkpoints of each particle, '
+                             'so interrupted jobs resume where they stopped')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError) as err:
+        parser.error('cannot read the manifest {0}: {1}'.format(
+                        args.manifest, err))
+    if not isinstance(manifest, dict):
+        parser.error('invalid manifest: expected a JSON object')
+    try:
+        jobs = expand_manifest(manifest)
+    except (TypeError, ValueError) as err:
+        parser.error('invalid manifest: {0}'.format(err))
+
+    output_dir = (args.output_dir or manifest.get('output_dir')
+                  or 'brownian_output')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    _write_json(os.path.join(output_dir, 'manifest.json'), manifest)
+    todo = []
+    for params in jobs:
+        job_dir = os.path.join(output_dir, job_id(params))
+        if os.path.exists(os.path.join(job_dir, 'summary.json')):
+            continue
+        todo.append((params, job_dir, args.checkpoint_every))
+    print('{0} jobs, {1} already completed, {2} to run'.format(
+            len(jobs), len(jobs) - len(todo), len(todo)))
+
+    failed = 0
+    if todo:
+        n_workers = min(args.jobs or multiprocessing.cpu_count(), len(todo))
+        pool = multiprocessing.Pool(n_workers)
+        try:
+            for job_dir, summary, error in pool.imap_unordered(_run_job_star,
+                                                               todo):
+                name = os.path.basename(job_dir)
+                if error is not None:
+                    failed += 1
+                    print('{0}: failed ({1})'.format(name, error))
+                elif summary['steps_per_sec'] is None:
+                    print('{0}: done (nothing left to run)'.format(name))
+                else:
+                    print('{0}: {1} steps in {2:.2f} s '
+                          '({3:.0f} steps/sec)'.format(
+                            name, summary['steps_run'], summary['elapsed'],
+                            summary['steps_per_sec']))
+        finally:
+            pool.close()
+            pool.join()
+
+    # index of the summaries of all completed jobs
+    results = []
+    for params in jobs:
+        path = os.path.join(output_dir, job_id(params), 'summary.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                results.append(json.load(f))
+    _write_json(os.path.join(output_dir, 'results.json'), results)
+    print('{0} of {1} jobs completed, results in {2}'.format(
+            len(results), len(jobs), output_dir))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
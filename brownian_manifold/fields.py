@@ -0,0 +1,141 @@
+"""
+Precomputed vector fields on a 2-sphere, used as drifts
+for Langevin dynamics in brownian-manifold
+"""
+
+import numpy as np
+
+
+class GriddedField(object):
+    """
+    Vector field sampled on a colatitude/azimuth grid of a 2-sphere and
+    interpolated (bilinearly, in pure numpy) at arbitrary points.
+
+    Passing a GriddedField as the 'drift' of
+    'Manifold.simulate_brownian_sphere' replaces a call to a Python
+    function at every step by an array lookup.
+
+    Parameters
+    ----------
+    values: array, n_theta x n_phi x 3, the field at the grid nodes:
+            colatitudes np.linspace(0, pi, n_theta) and
+            azimuths np.arange(n_phi)*2*pi/n_phi (periodic)
+
+    Callable Methods
+    -------
+    from_function
+
+    from_potential
+
+    nodes
+    """
+
+    def __init__(self, values):
+        """
+        Initialize the object
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 3 or values.shape[2] != 3 or \
+                values.shape[0] < 2 or values.shape[1] < 1:
+            raise ValueError('values must be an n_theta x n_phi x 3 array!')
+        self.values = values
+        self.n_theta, self.n_phi = values.shape[:2]
+
+    def __repr__(self):
+        """An internal representation"""
+        return "{0}(n_theta={1}, n_phi={2})".format(
+                self.__class__.__name__, self.n_theta, self.n_phi)
+
+    # -----------------------------------------------------------------------
+    @staticmethod
+    def nodes(n_theta, n_phi, radius=1):
+        """
+        Grid nodes on the sphere of radius 'radius'
+
+        Returns
+        -------
+        points: array, n_theta x n_phi x 3
+        """
+        theta = np.linspace(0, np.pi, n_theta)
+        phi = np.arange(n_phi)*2*np.pi/n_phi
+        theta, phi = np.meshgrid(theta, phi, indexing='ij')
+        return radius*np.stack([np.sin(theta)*np.cos(phi),
+                                np.sin(theta)*np.sin(phi),
+                                np.cos(theta)], axis=-1)
+
+    @classmethod
+    def from_function(cls, func, n_theta=91, n_phi=180, radius=1):
+        """
+        Sample a vectorized field once on the grid nodes
+
+        Parameters
+        ----------
+        func: callable, maps an n x 3 array of points to an n x 3 array
+
+        n_theta, n_phi: int, grid size
+
+        radius: float, radius of the sphere
+
+        Returns
+        -------
+        field: GriddedField
+        """
+        points = cls.nodes(n_theta, n_phi, radius).reshape(-1, 3)
+        values = np.asarray(func(points), dtype=float)
+        return cls(values.reshape(n_theta, n_phi, 3))
+
+    @classmethod
+    def from_potential(cls, potential, n_theta=91, n_phi=180, radius=1,
+                       h=1e-5):
+        """
+        Sample the force -grad(potential) once on the grid nodes,
+        using central differences
+
+        Parameters
+        ----------
+        potential: callable, maps an n x 3 array of points to n values
+
+        n_theta, n_phi: int, grid size
+
+        radius: float, radius of the sphere
+
+        h: float, finite difference step
+
+        Returns
+        -------
+        field: GriddedField
+        """
+        points = cls.nodes(n_theta, n_phi, radius).reshape(-1, 3)
+        force = np.zeros_like(points)
+        for k in range(3):
+            shift = np.zeros(3)
+            shift[k] = h
+            force[:, k] = -(np.asarray(potential(points + shift)) -
+                            np.asarray(potential(points - shift)))/(2*h)
+        return cls(force.reshape(n_theta, n_phi, 3))
+
+    # -----------------------------------------------------------------------
+    def __call__(self, points):
+        """
+        Interpolate the field at 'points' (n x 3, any radius)
+
+        Returns
+        -------
+        vectors: array, n x 3
+        """
+        points = np.atleast_2d(points)
+        r = np.sqrt(np.sum(points**2, axis=1))
+        theta = np.arccos(np.clip(points[:,2]/r, -1, 1))
+        phi = np.mod(np.arctan2(points[:,1], points[:,0]), 2*np.pi)
+
+        t = theta/np.pi*(self.n_theta - 1)
+        i0 = np.clip(np.floor(t).astype(int), 0, self.n_theta - 2)
+        wt = (t - i0)[:, np.newaxis]
+        p = phi/(2*np.pi)*self.n_phi
+        j0 = np.floor(p).astype(int) % self.n_phi
+        wp = (p - np.floor(p))[:, np.newaxis]
+        j1 = (j0 + 1) % self.n_phi
+
+        v = self.values
+        return ((1 - wt)*((1 - wp)*v[i0, j0] + wp*v[i0, j1]) +
+                wt*((1 - wp)*v[i0 + 1, j0] + wp*v[i0 + 1, j1]))
@@ -7,6 +7,9 @@ from mpl_toolkits.mplot3d import Axes3D
 
 #ignore the warning from * (import all functionality utils)
 from brownian_manifold.utils import *
+from brownian_manifold.neighbors import PairInteraction, verlet_skin
+from brownian_manifold.checkpoint import (CheckpointWriter, load_checkpoint,
+                                          walker_state, rng_state_from)
 
 
 class Manifold(object):
@@ -53,14 +56,26 @@ class Manifold(object):
 
     height_cylinder: float, height of cylinder
 
+    random_state: None, int or np.random.RandomState, seed of the walks
+    (None uses the global numpy random state)
+
     Internal variables
     ------------------
     store_matrices_: float,  3 x 3 x n_steps, rotation matrix
 
+    random_state_: np.random.RandomState, generator used for the walks
+
+    start_step_: int, step the last walk started from
+    (non-zero when it was resumed from a checkpoint)
+
     Callable Methods
     -------
     simulate_brownian_sphere
 
+    resume
+
+    simulate_interacting_sphere
+
     plot_brownian_sphere
 
     simulate_brownian_cylinder
@@ -80,6 +95,10 @@ class Manifold(object):
     _rot_matrix
 
     _smooth_and_rotate
+
+    _walk_sphere
+
+    _langevin_sphere
     """
 
     def __init__(self,
@@ -89,7 +108,8 @@ class Manifold(object):
                  height_cylinder = 10,
                  final_time=1,
                  n_steps=1000,
-                 plt_interactive=True):
+                 plt_interactive=True,
+                 random_state=None):
         """
         Initialize the object
         """
@@ -100,6 +120,11 @@ class Manifold(object):
         # Assign random rotation matrix parameter
         # -------------------------------
         self.store_matrices_ = np.zeros((3,3,n_steps))
+        # Assign random number generator
+        # -------------------------------
+        self.random_state = random_state
+        self.random_state_ = check_random_state(random_state)
+        self.start_step_ = 0
         # Assign manifold parameters
         # -------------------------------
         # Default 2-sphere: the unit 2-sphere, the surface of a unit ball.
@@ -157,9 +182,11 @@ class Manifold(object):
         # Approximate Brownian Motion on sphere
         # Finds a Brownian step on tangent plane
         x_coord = stats.norm.rvs(scale=np.sqrt(self.step_size),
-                                 size = self.n_steps)
+                                 size = self.n_steps,
+                                 random_state=self.random_state_)
         y_coord = stats.norm.rvs(scale=np.sqrt(self.step_size),
-                                 size = self.n_steps)
+                                 size = self.n_steps,
+                                 random_state=self.random_state_)
         step_size = np.sqrt(x_coord**2 +y_coord**2)
         # Smooths the step onto the sphere
         theta = arctan2(y_coord,x_coord)
@@ -215,7 +242,10 @@ class Manifold(object):
 
 
     # -----------------------------------------------------------------------
-    def simulate_brownian_sphere(self, manifold=None, plot=False):
+    def simulate_brownian_sphere(self, manifold=None, plot=False,
+                                 checkpoint_path=None, checkpoint_every=None,
+                                 drift=None, n_particles=None,
+                                 initial_position=None):
         """
 
         1. Implementation of '_smooth_and_rotate' class method:
@@ -248,6 +278,52 @@ class Manifold(object):
         'browniansphere'. The final position should be [0,0,radius_sphere]
         (with minimal rounding error), as this is the position of the north pole
         for 2-sphere embedded in three-dimensional Euclidian space
+
+        3. Checkpointing (optional):
+
+        If 'checkpoint_path' and 'checkpoint_every' are given, the state
+        of the walk (positions so far, step index and the state of
+        'random_state_' before the steps were drawn) is written to
+        'checkpoint_path' every 'checkpoint_every' steps on a background
+        thread. An interrupted run can be continued with the 'resume'
+        method and gives the same 'browniansphere' as an uninterrupted run.
+
+        4. Drift and ensembles (Langevin dynamics, see '_langevin_sphere'):
+
+        If a 'drift', a number of particles 'n_particles' or an
+        'initial_position' is given, the walks are run in fixed coordinates (the frame of the drift)
+        instead of being rotated back to the north pole: at each step
+        the tangent plane Gaussian step plus drift*step_size is smoothed
+        onto the sphere from the particle's current position.
+
+        Parameters
+        ----------
+        manifold: str, 'sphere'
+
+        plot: bool, if True then plot
+
+        checkpoint_path: str, file the checkpoints are written to
+                         (not available with a drift, an ensemble
+                         or an initial position)
+
+        checkpoint_every: int, number of steps between checkpoints
+
+        drift: callable, maps the n x 3 array of the particles' positions
+               to an n x 3 array of drift vectors (e.g. a force
+               -grad(potential)). It is called once per step for the
+               whole ensemble and only its tangent component is used.
+               A 'GriddedField' avoids evaluating a Python function
+               at every step.
+
+        n_particles: int, number of independent particles
+
+        initial_position: array, 3 or n_particles x 3, starting point(s)
+                          (default: the north pole [0,0,radius_sphere])
+
+        Returns
+        -------
+        browniansphere: ndarray, n_steps x 3
+                        (n_particles x n_steps x 3 if n_particles is given)
         """
 
         if manifold is None:
@@ -264,18 +340,117 @@ class Manifold(object):
             raise NameError('{0} is not a recognized\n\
             manifold!'.format(manifold))
         #------------------------------------------------------------
-        smoothpositions, rotationmatricies= self._smooth_and_rotate()
+        if drift is not None or n_particles is not None or \
+                initial_position is not None:
+            if checkpoint_path is not None:
+                raise ValueError('checkpoints are not available with a\n\
+                drift, several particles or an initial position!')
+            browniansphere = self._langevin_sphere(drift, n_particles,
+                                                   initial_position)
+            if plot is True:
+                self.plot_brownian_sphere(browniansphere if
+                                          n_particles is None else
+                                          browniansphere[0])
+            return browniansphere
+
+        # state of the generator before the steps are drawn: enough to
+        # redraw the exact same steps when resuming from a checkpoint
+        rng_state = self.random_state_.get_state()
+        # for debugging purposes- does not affect functionality
+        #-------------------------------------------------------------
+        if checkpoint_path is not None and checkpoint_every and \
+                not (isinstance(rng_state, tuple) and
+                     rng_state[0] == 'MT19937'):
+            raise ValueError('checkpoints need a random_state using the\n\
+            MT19937 generator (e.g. np.random.RandomState(seed))!')
+        #------------------------------------------------------------
         # arbitrary vector just used for initial update column vector for the
         # matrix rotation...but the vector doesn't factor into the data.
         updator = np.array([[0],[0],[0]])
 
-        for i in range (self.n_steps):
-            position_vector_temp=np.reshape(smoothpositions[:,i],(3,1))
-            position_vector_temp2 = np.append(updator,
-                                              position_vector_temp,axis=-1)
-            final_data_frame = np.dot(rotationmatricies[:,:,i],
-                                      position_vector_temp2)
-            updator = final_data_frame
+        return self._walk_sphere(updator, 0, rng_state, plot,
+                                 checkpoint_path, checkpoint_every)
+
+
+    # -----------------------------------------------------------------------
+    def resume(self, path, plot=False, checkpoint_every=None):
+        """
+        Continue a 'simulate_brownian_sphere' run from a checkpoint
+        written with 'checkpoint_path'. The result is identical to the
+        one of the uninterrupted run.
+
+        Parameters
+        ----------
+        path: str, the checkpoint file
+
+        plot: bool, if True then plot
+
+        checkpoint_every: int, number of steps between new checkpoints
+                          (written to 'path')
+
+        Returns
+        -------
+        browniansphere: ndarray, n_steps x 3
+        """
+        state = load_checkpoint(path)
+        # for debugging purposes- does not affect functionality
+        #-------------------------------------------------------------
+        if str(state['manifold']) != self.manifold:
+            raise NameError('the checkpoint was written for the {0}\n\
+            manifold!'.format(state['manifold']))
+
+        for name in ('radius_sphere', 'final_time', 'n_steps'):
+            if state[name] != getattr(self, name):
+                raise ValueError('the checkpoint was written with\n\
+                {0}={1}, not {2}!'.format(name, state[name],
+                                          getattr(self, name)))
+        #------------------------------------------------------------
+        return self._walk_sphere(state['positions'], int(state['step']),
+                                 rng_state_from(state), plot,
+                                 path, checkpoint_every)
+
+
+    # -----------------------------------------------------------------------
+    def _walk_sphere(self, updator, start, rng_state, plot,
+                     checkpoint_path=None, checkpoint_every=None):
+        """
+        Runs the rotations of 'simulate_brownian_sphere' from step
+        'start' on, with 'updator' holding the walk so far. The steps
+        are (re)drawn from 'rng_state' by the '_smooth_and_rotate'
+        class method.
+        """
+        self.start_step_ = start
+        self.random_state_.set_state(rng_state)
+        smoothpositions, rotationmatricies= self._smooth_and_rotate()
+
+        writer = None
+        if checkpoint_path is not None and checkpoint_every:
+            writer = CheckpointWriter(checkpoint_path)
+
+        final_data_frame = updator
+        try:
+            for i in range (start, self.n_steps):
+                position_vector_temp=np.reshape(smoothpositions[:,i],(3,1))
+                position_vector_temp2 = np.append(updator,
+                                                  position_vector_temp,axis=-1)
+                final_data_frame = np.dot(rotationmatricies[:,:,i],
+                                          position_vector_temp2)
+                updator = final_data_frame
+                # 'updator' is a new array at every step, so it can be
+                # handed to the writer thread without a copy
+                if (writer is not None and (i+1) % checkpoint_every == 0
+                        and i+1 < self.n_steps):
+                    writer.submit(walker_state(self, i+1, updator,
+                                               rng_state))
+        except BaseException:
+            # flush the last checkpoint (e.g. on preemption) without
+            # hiding the exception that stopped the walk
+            if writer is not None:
+                writer.close(raise_error=False)
+            raise
+        if writer is not None:
+            writer.close()
+
         browniansphere = np.transpose(final_data_frame[:,1:])
         # Show the Brownian Motion simulation
         # on 2-sphere (with defaults). will be a snapshot of all n_steps
@@ -286,6 +461,143 @@ class Manifold(object):
         return browniansphere
 
 
+    # -----------------------------------------------------------------------
+    def _langevin_sphere(self, drift=None, n_particles=None,
+                         initial_position=None, record_every=1):
+        """
+        Euler-Maruyama scheme for Brownian motion with drift on the
+        2-sphere, vectorized over an ensemble of particles.
+
+        At each step, a Gaussian step of the tangent plane (an isotropic
+        Gaussian in R^3 projected onto the tangent plane, with scale
+        sqrt(step_size)) plus the tangent component of drift*step_size
+        is smoothed onto the sphere along a great circle
+        (see 'geodesic_step' in brownian_manifold.utils).
+        Without drift this is the same walk as the rotation scheme of
+        'simulate_brownian_sphere', in fixed coordinates.
+        Positions are stored every 'record_every' steps.
+        """
+        self.start_step_ = 0
+        n = 1 if n_particles is None else int(n_particles)
+        if initial_position is None:
+            initial_position = [0, 0, self.radius_sphere]
+        initial_position = np.asarray(initial_position, dtype=float)
+        # for debugging purposes- does not affect functionality
+        #-------------------------------------------------------------
+        if initial_position.shape not in ((3,), (n, 3)):
+            raise ValueError('initial_position must have shape (3,) or\n\
+            ({0}, 3), not {1}!'.format(n, initial_position.shape))
+        #------------------------------------------------------------
+        positions = np.empty((n, 3))
+        positions[:] = initial_position
+        positions = self.radius_sphere*positions/np.sqrt(
+                        np.sum(positions**2, axis=1))[:, np.newaxis]
+
+        record_every = int(record_every)
+        browniansphere = np.empty((n, self.n_steps//record_every, 3))
+        scale = np.sqrt(self.step_size)
+        for i in range(self.n_steps):
+            steps = self.random_state_.normal(scale=scale, size=(n, 3))
+            if drift is not None:
+                steps = steps + self.step_size*np.asarray(drift(positions))
+            steps = tangent_component(positions, steps)
+            positions = geodesic_step(positions, steps, self.radius_sphere)
+            if (i+1) % record_every == 0:
+                browniansphere[:, (i+1)//record_every - 1] = positions
+
+        if n_particles is None:
+            return browniansphere[0]
+        return browniansphere
+
+
+    # -----------------------------------------------------------------------
+    def simulate_interacting_sphere(self, n_particles, pair_force, cutoff,
+                                    skin=None, drift=None,
+                                    initial_position=None, record_every=1,
+                                    rebuild_every=10, manifold=None):
+        """
+        Brownian motion of 'n_particles' particles on the same 2-sphere
+        with short-range pairwise interactions (e.g. soft repulsion or
+        exclusion), on top of an optional external 'drift'.
+
+        Pairs are found with a Verlet neighbor list (see
+        brownian_manifold.neighbors.VerletList) rebuilt when a
+        particle moved more than skin/2, and the pair forces are
+        evaluated in vectorized batches over the list: the cost of a
+        step grows with the number of close pairs, not with
+        n_particles**2. The particles then move as in
+        'simulate_brownian_sphere' with a drift.
+        Everything runs on a single core (neighbor search, forces and
+        random numbers); there is no multicore parallelism yet.
+
+        Parameters
+        ----------
+        n_particles: int, number of particles
+
+        pair_force: callable, maps an array of geodesic distances to
+                    force magnitudes (positive = repulsive),
+                    e.g. brownian_manifold.neighbors.soft_repulsion
+
+        cutoff: float, interaction range (geodesic distance)
+
+        skin: float, Verlet skin. The default is sized from
+              sqrt(step_size) so that the list is rebuilt about every
+              'rebuild_every' steps (see neighbors.verlet_skin), but
+              capped at 'cutoff' since a wider skin makes the pairs to
+              check at every step cost more than the rebuilds it saves.
+              When sqrt(step_size) is not small next to 'cutoff' the
+              list is therefore rebuilt at nearly every step.
+
+        drift: callable, external drift (see 'simulate_brownian_sphere')
+
+        initial_position: array, n_particles x 3, starting points
+                          (default: uniformly distributed on the sphere)
+
+        record_every: int, number of steps between stored positions
+
+        rebuild_every: int, expected number of steps between rebuilds
+                       of the neighbor list (used when skin is None)
+
+        manifold: str, 'sphere'
+
+        Returns
+        -------
+        browniansphere: ndarray, n_particles x (n_steps//record_every) x 3
+        """
+        if manifold is None:
+            manifold = self.manifold
+        # for debugging purposes- does not affect functionality
+        #-------------------------------------------------------------
+        if manifold != 'sphere':
+            raise NameError('the {0} manifold is not used\n\
+            for the simulate_interacting_sphere method!'.format(manifold))
+
+        n_particles = int(n_particles)
+        if initial_position is not None and \
+                np.shape(initial_position) != (n_particles, 3):
+            raise ValueError('initial_position must have shape\n\
+            ({0}, 3), not {1}!'.format(n_particles,
+                                      np.shape(initial_position)))
+        #------------------------------------------------------------
+        if initial_position is None:
+            initial_position = self.random_state_.normal(
+                                                size=(n_particles, 3))
+        if skin is None:
+            skin = min(verlet_skin(self.step_size, n_particles,
+                                   rebuild_every), cutoff)
+
+        interaction = PairInteraction(pair_force, cutoff, skin,
+                                      self.radius_sphere)
+        if drift is None:
+            total_drift = interaction
+        else:
+            def total_drift(positions):
+                return interaction(positions) + drift(positions)
+
+        return self._langevin_sphere(total_drift, n_particles,
+                                     initial_position, record_every)
+
+
 
     # -----------------------------------------------------------------------
     def plot_brownian_sphere(self, sphere_bm,
@@ -0,0 +1,211 @@
+"""
+Neighbor lists and pairwise interactions for ensembles of particles
+diffusing on a 2-sphere
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from brownian_manifold.utils import tangent_component
+
+
+def soft_repulsion(strength=1.0, sigma=0.1):
+    """
+    Harmonic soft-disk repulsion: particles closer than 'sigma'
+    (geodesic distance) push each other apart with a force
+    strength*(1 - d/sigma). A large 'strength' approximates
+    hard-core exclusion.
+
+    Returns
+    -------
+    force: callable, maps an array of geodesic distances to
+           force magnitudes (positive = repulsive)
+    """
+    def force(d):
+        return strength*np.clip(1 - d/sigma, 0, None)
+    return force
+
+
+def verlet_skin(step_size, n_particles, rebuild_every=10):
+    """
+    helper to size the skin of a 'VerletList' for Brownian particles
+
+    Over m steps the tangent displacement of a particle is Gaussian with
+    scale sqrt(m*step_size) per direction, and the largest of n such
+    displacements is about sqrt(2*m*step_size*log(n)). The returned
+    skin is twice that for m = rebuild_every, so that the list is
+    rebuilt about every 'rebuild_every' steps (drift and pair forces
+    move the particles further and make rebuilds more frequent).
+
+    Parameters
+    ----------
+    step_size: float, time step of the walk
+
+    n_particles: int, number of particles
+
+    rebuild_every: int, expected number of steps between rebuilds
+
+    Returns
+    -------
+    skin: float
+    """
+    return 2*np.sqrt(2*rebuild_every*step_size*np.log(max(n_particles, 2)))
+
+
+
+class VerletList(object):
+    """
+    Verlet neighbor list of particles on a sphere of radius 'radius'.
+
+    The list holds every pair closer than cutoff + skin (geodesic
+    distance) and is built with a KD-tree on the embedding coordinates.
+    It is rebuilt as soon as a particle has moved more than skin/2 since
+    the last build. Brownian particles move by about sqrt(step_size) at
+    every step, so unless the skin is several times larger (see
+    'verlet_skin') the list is rebuilt at nearly every step; a larger
+    skin trades fewer rebuilds for more pairs to check per step.
+
+    Note: the build (KD-tree construction and 'query_pairs') runs on a
+    single core, as does the force evaluation of 'PairInteraction'.
+    With 1e5 particles and frequent rebuilds the build is a large part
+    of the cost of a step.
+
+    Parameters
+    ----------
+    cutoff: float, interaction range (geodesic distance)
+
+    skin: float, extra range of the list
+
+    radius: float, radius of the sphere
+
+    Internal variables
+    ------------------
+    pairs_: int, n_pairs x 2, the pairs (i < j) of the list
+
+    n_builds_: int, number of times the list was built
+    """
+
+    def __init__(self, cutoff, skin, radius=1):
+        """
+        Initialize the object
+        """
+        self.cutoff = float(cutoff)
+        self.skin = float(skin)
+        self.radius = float(radius)
+        self.pairs_ = np.zeros((0, 2), dtype=np.intp)
+        self.n_builds_ = 0
+        self._reference = None
+
+    def __repr__(self):
+        """An internal representation"""
+        return "{0}(cutoff={1}, skin={2}, radius={3})".format(
+                self.__class__.__name__, self.cutoff, self.skin, self.radius)
+
+    def _chord(self, d):
+        """helper: chord length of a geodesic distance"""
+        return 2*self.radius*np.sin(np.minimum(d/(2*self.radius), np.pi/2))
+
+    def build(self, positions):
+        """
+        Build the list for 'positions' (n x 3)
+        """
+        tree = cKDTree(positions)
+        self.pairs_ = tree.query_pairs(self._chord(self.cutoff + self.skin),
+                                       output_type='ndarray')
+        self._reference = positions.copy()
+        self.n_builds_ += 1
+
+    def update(self, positions):
+        """
+        Rebuild the list if a particle moved more than skin/2
+        since the last build
+
+        Returns
+        -------
+        pairs: int, n_pairs x 2
+        """
+        if self._reference is None or \
+                len(self._reference) != len(positions):
+            self.build(positions)
+            return self.pairs_
+        chord = np.sqrt(np.max(np.sum((positions - self._reference)**2,
+                                      axis=1)))
+        moved = 2*self.radius*np.arcsin(min(chord/(2*self.radius), 1))
+        if moved > self.skin/2:
+            self.build(positions)
+        return self.pairs_
+
+
+class PairInteraction(object):
+    """
+    Pairwise central forces between particles on a sphere, evaluated
+    in vectorized batches over the pairs of a 'VerletList'.
+
+    The force between two particles at geodesic distance d < cutoff
+    has magnitude force(d) and acts on each particle along the great
+    circle joining them (tangent to the sphere). Instances are callable
+    and can be used as (part of) the drift of
+    'Manifold.simulate_brownian_sphere'.
+
+    Parameters
+    ----------
+    force: callable, maps an array of geodesic distances to force
+           magnitudes (positive = repulsive), e.g. 'soft_repulsion'
+
+    cutoff: float, interaction range (geodesic distance)
+
+    skin: float, Verlet skin (see 'verlet_skin')
+
+    radius: float, radius of the sphere
+    """
+
+    def __init__(self, force, cutoff, skin, radius=1):
+        """
+        Initialize the object
+        """
+        self.force = force
+        self.cutoff = float(cutoff)
+        self.radius = float(radius)
+        self.neighbors = VerletList(cutoff, skin, radius)
+
+    def __call__(self, positions):
+        """
+        Forces on the particles at 'positions'
+
+        Parameters
+        ----------
+        positions: array, n x 3, points on the sphere
+
+        Returns
+        -------
+        forces: array, n x 3, tangent to the sphere
+        """
+        n = len(positions)
+        forces = np.zeros((n, 3))
+        pairs = self.neighbors.update(positions)
+        if len(pairs) == 0:
+            return forces
+        i, j = pairs[:,0], pairs[:,1]
+        cos_ij = np.sum(positions[i]*positions[j], axis=1)/self.radius**2
+        d = self.radius*np.arccos(np.clip(cos_ij, -1, 1))
+        close = d < self.cutoff
+        i, j, d = i[close], j[close], d[close]
+        if len(d) == 0:
+            return forces
+        magnitude = np.asarray(self.force(d), dtype=float)[:, np.newaxis]
+
+        # direction of the great circle leading away from the other
+        # particle, at each end of the pair
+        separation = positions[i] - positions[j]
+        away_i = tangent_component(positions[i], separation)
+        away_j = tangent_component(positions[j], -separation)
+        for away in (away_i, away_j):
+            norm = np.sqrt(np.sum(away**2, axis=1))[:, np.newaxis]
+            away /= np.where(norm > 0, norm, 1)
+
+        for k in range(3):
+            forces[:, k] = (np.bincount(i, magnitude[:,0]*away_i[:,k],
+                                        minlength=n) +
+                            np.bincount(j, magnitude[:,0]*away_j[:,k],
+                                        minlength=n))
+        return forces
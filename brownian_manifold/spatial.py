@@ -0,0 +1,387 @@
+"""
+Spatial index over the points of Brownian motion trajectories on a 2-sphere
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class SphereIndex(object):
+    """
+    Cell-bucketed index over trajectory points on a 2-sphere, built once
+    per trajectory (or ensemble of trajectories) and queried many times.
+
+    The sphere is split into 'n_z' bands of equal height in z (hence equal
+    area, by Archimedes' hat-box theorem) and each band into 'n_phi'
+    azimuth sectors. Every cell keeps its occupancy count, the step of its
+    first visit and its time-ordered list of visits. Cap and band queries
+    only look at the points of the cells cut by the boundary of the
+    region, the other cells are counted as a whole.
+
+    Points can be added in chunks (e.g. as a simulation streams them).
+    On the first query following an 'add', only the new points are
+    sorted and merged into the sorted arrays; the KD-tree used by
+    'nearest_visit' is rebuilt lazily.
+
+    Parameters
+    ----------
+    n_z: int, number of bands in z
+
+    n_phi: int, number of azimuth sectors per band
+
+    Internal variables
+    ------------------
+    counts_: int, n_z*n_phi, number of points in each cell
+
+    n_points_: int, total number of points in the index
+
+    Callable Methods
+    -------
+    add
+
+    cell_of
+
+    visits
+
+    occupancy
+
+    first_visits
+
+    count_cap
+
+    cap_fraction
+
+    band_fraction
+
+    first_visit_cap
+
+    nearest_visit
+    """
+
+    def __init__(self, n_z=64, n_phi=128):
+        """
+        Initialize the object
+        """
+        self.n_z = int(n_z)
+        self.n_phi = int(n_phi)
+        self.n_cells = self.n_z*self.n_phi
+        self.counts_ = np.zeros(self.n_cells, dtype=np.int64)
+        self.n_points_ = 0
+        # step of the first visit of each cell (max int if never visited)
+        self._first = np.full(self.n_cells, np.iinfo(np.int64).max,
+                              dtype=np.int64)
+        self._chunks = []
+        self._built = True
+        # points/steps of the built index: views of growing buffers
+        self._buffers = (np.zeros((0,3)), np.zeros(0, dtype=np.int64))
+        self._points, self._steps = self._buffers
+        self._order = np.zeros(0, dtype=np.int64)
+        # sorted (cell, step) keys packed as cell*span + step - lo
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._key_lo = 0
+        self._key_span = 1
+        self._starts = np.zeros(self.n_cells + 1, dtype=np.int64)
+        self._tree = None
+        self._cell_geometry()
+
+    def __repr__(self):
+        """An internal representation"""
+        return "{0}(n_z={1}, n_phi={2}) --- {3} points".format(
+                self.__class__.__name__, self.n_z, self.n_phi,
+                self.n_points_)
+
+    # -----------------------------------------------------------------------
+    def _cell_geometry(self):
+        """
+        Centers of the cells (unit vectors) and an upper bound on the
+        angular distance between a cell's center and any of its points:
+        half the colatitude width plus half the azimuth width scaled by
+        the largest sin(colatitude) in the band.
+        """
+        z_edges = np.linspace(1, -1, self.n_z + 1)
+        theta_edges = np.arccos(z_edges)
+        theta_lo, theta_hi = theta_edges[:-1], theta_edges[1:]
+        theta_c = (theta_lo + theta_hi)/2
+        sin_max = np.where((theta_lo <= np.pi/2) & (theta_hi >= np.pi/2),
+                           1.0, np.maximum(np.sin(theta_lo),
+                                           np.sin(theta_hi)))
+        half_phi = np.pi/self.n_phi
+        phi_c = (2*np.arange(self.n_phi) + 1)*half_phi
+
+        theta_c, phi_c = np.meshgrid(theta_c, phi_c, indexing='ij')
+        self._centers = np.array([np.sin(theta_c)*np.cos(phi_c),
+                                  np.sin(theta_c)*np.sin(phi_c),
+                                  np.cos(theta_c)]).reshape(3, -1).T
+        radius = (theta_hi - theta_lo)/2 + sin_max*half_phi
+        self._radius = np.repeat(radius, self.n_phi)
+
+    # -----------------------------------------------------------------------
+    def cell_of(self, points):
+        """
+        Cell index of each point
+
+        Parameters
+        ----------
+        points: array, n x 3 (or 3), points on (or around) the sphere
+
+        Returns
+        -------
+        cells: array of ints, n (band*n_phi + sector)
+        """
+        units = _unit(points)
+        band = np.floor((1 - units[:,2])/2*self.n_z).astype(np.int64)
+        band = np.clip(band, 0, self.n_z - 1)
+        phi = np.mod(np.arctan2(units[:,1], units[:,0]), 2*np.pi)
+        sector = np.floor(phi/(2*np.pi)*self.n_phi).astype(np.int64)
+        sector = np.clip(sector, 0, self.n_phi - 1)
+        return band*self.n_phi + sector
+
+    # -----------------------------------------------------------------------
+    def add(self, points, steps=None):
+        """
+        Add a chunk of trajectory points to the index
+
+        Parameters
+        ----------
+        points: array, n x 3, e.g. the 'browniansphere' array returned by
+                'Manifold.simulate_brownian_sphere' (any radius)
+
+        steps: array of ints, n, step number of each point.
+               Defaults to continuing the numbering of the points
+               already in the index. For an ensemble, pass the step
+               numbers of each trajectory (e.g. np.arange(n_steps)).
+
+        Returns
+        -------
+        self
+        """
+        units = _unit(points)
+        if steps is None:
+            steps = np.arange(self.n_points_, self.n_points_ + len(units))
+        steps = np.asarray(steps, dtype=np.int64)
+        if steps.shape != (len(units),):
+            raise ValueError('steps must have one entry per point!')
+        if len(units) == 0:
+            # e.g. a simulation flushing no new steps
+            return self
+
+        cells = self.cell_of(units)
+        self.counts_ += np.bincount(cells, minlength=self.n_cells)
+        np.minimum.at(self._first, cells, steps)
+        self.n_points_ += len(units)
+        self._chunks.append((units, steps, cells))
+        self._built = False
+        return self
+
+    # -----------------------------------------------------------------------
+    def _build(self):
+        """
+        Merge the added chunks: points sorted by cell then by step,
+        with the offsets of each cell in the sorted array. Only the new
+        points are sorted, they are then inserted into the existing
+        order with a binary search on packed (cell, step) keys.
+        """
+        if self._built or not self._chunks:
+            self._built = True
+            return
+        n_old = len(self._points)
+        points = np.concatenate([c[0] for c in self._chunks])
+        steps = np.concatenate([c[1] for c in self._chunks])
+        cells = np.concatenate([c[2] for c in self._chunks])
+        self._chunks = []
+        self._append(points, steps)
+
+        new_order = np.lexsort((steps, cells))
+        steps, cells = steps[new_order], cells[new_order]
+        lo = min(steps[0] if n_old == 0 else self._key_lo, steps.min())
+        if n_old == 0 or lo < self._key_lo or \
+                steps.max() - lo >= self._key_span:
+            # the steps outgrew the packing: repack all the keys with
+            # room for steps up to twice the current range
+            self._key_lo = lo
+            self._key_span = 2*int(self._steps.max() - lo + 1)
+            if self.n_cells*self._key_span >= 2**62:
+                raise ValueError('steps span too wide a range!')
+            self._order = np.lexsort((self._steps, self.cell_of(
+                                                        self._points)))
+            self._keys = self._pack(self.cell_of(self._points[self._order]),
+                                    self._steps[self._order])
+        else:
+            new_keys = self._pack(cells, steps)
+            at = np.searchsorted(self._keys, new_keys, side='right')
+            self._keys = np.insert(self._keys, at, new_keys)
+            self._order = np.insert(self._order, at, new_order + n_old)
+        self._starts = np.concatenate(([0], np.cumsum(self.counts_)))
+        self._tree = None
+        self._built = True
+
+    def _pack(self, cells, steps):
+        """helper to pack (cell, step) into sortable integer keys"""
+        return cells*self._key_span + (steps - self._key_lo)
+
+    def _append(self, points, steps):
+        """
+        helper to append points/steps to the buffers, doubling their
+        capacity when full so that streaming is not quadratic
+        """
+        n_old, n_new = len(self._points), len(points)
+        buf_points, buf_steps = self._buffers
+        if n_old + n_new > len(buf_points):
+            size = max(2*len(buf_points), n_old + n_new)
+            buf_points = np.resize(buf_points, (size, 3))
+            buf_steps = np.resize(buf_steps, size)
+            self._buffers = (buf_points, buf_steps)
+        buf_points[n_old:n_old + n_new] = points
+        buf_steps[n_old:n_old + n_new] = steps
+        self._points = buf_points[:n_old + n_new]
+        self._steps = buf_steps[:n_old + n_new]
+
+    def _members(self, cells):
+        """Positions (in the sorted arrays) of the points of 'cells'"""
+        lengths = self.counts_[cells]
+        total = lengths.sum()
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        # concatenation of the ranges starts[c]:starts[c+1]
+        offsets = np.repeat(self._starts[cells] - np.cumsum(lengths)
+                            + lengths, lengths)
+        return self._order[offsets + np.arange(total)]
+
+    def _split_cells(self, center, alpha):
+        """
+        Cells entirely inside the cap of angle 'alpha' around 'center',
+        and cells cut by its boundary.
+        """
+        cos_center = np.clip(np.dot(self._centers, center), -1, 1)
+        dist = np.arccos(cos_center)
+        inside = dist + self._radius < alpha
+        cut = ~inside & (dist - self._radius <= alpha)
+        return np.nonzero(inside)[0], np.nonzero(cut & (self.counts_ > 0))[0]
+
+    # -----------------------------------------------------------------------
+    def visits(self, cell):
+        """
+        Steps at which 'cell' was visited, in time order
+
+        Parameters
+        ----------
+        cell: int, cell index (see 'cell_of')
+
+        Returns
+        -------
+        steps: array of ints
+        """
+        self._build()
+        start, stop = self._starts[cell], self._starts[cell + 1]
+        return self._steps[self._order[start:stop]]
+
+    def occupancy(self):
+        """
+        Fraction of the points lying in each cell
+
+        Returns
+        -------
+        occupancy: array, n_z x n_phi
+        """
+        occupancy = self.counts_/float(max(self.n_points_, 1))
+        return occupancy.reshape(self.n_z, self.n_phi)
+
+    def first_visits(self):
+        """
+        Step of the first visit of each cell (-1 if never visited)
+
+        Returns
+        -------
+        first: array of ints, n_z x n_phi
+        """
+        first = np.where(self.counts_ > 0, self._first, -1)
+        return first.reshape(self.n_z, self.n_phi)
+
+    # -----------------------------------------------------------------------
+    def count_cap(self, center, alpha):
+        """
+        Number of points within an angle 'alpha' (radians) of 'center'
+
+        Parameters
+        ----------
+        center: array, 3, a point on (or around) the sphere
+
+        alpha: float, angular radius of the cap
+
+        Returns
+        -------
+        count: int
+        """
+        self._build()
+        center = _unit(center)[0]
+        inside, cut = self._split_cells(center, alpha)
+        members = self._members(cut)
+        in_cap = np.dot(self._points[members], center) >= np.cos(alpha)
+        return int(self.counts_[inside].sum() + in_cap.sum())
+
+    def cap_fraction(self, center, alpha):
+        """
+        Fraction of the points (i.e. of the time spent) within
+        an angle 'alpha' (radians) of 'center'
+        """
+        return self.count_cap(center, alpha)/float(max(self.n_points_, 1))
+
+    def band_fraction(self, center, alpha_min, alpha_max):
+        """
+        Fraction of the points whose angle to 'center' lies in
+        (alpha_min, alpha_max]. With center=[0,0,1] this is a band
+        of colatitudes.
+        """
+        count = self.count_cap(center, alpha_max)
+        if alpha_min >= 0:
+            count -= self.count_cap(center, alpha_min)
+        return count/float(max(self.n_points_, 1))
+
+    def first_visit_cap(self, center, alpha):
+        """
+        First step at which the trajectory came within an angle
+        'alpha' (radians) of 'center' (-1 if it never did)
+        """
+        self._build()
+        center = _unit(center)[0]
+        inside, cut = self._split_cells(center, alpha)
+        inside = inside[self.counts_[inside] > 0]
+        first = self._first[inside]
+        members = self._members(cut)
+        in_cap = np.dot(self._points[members], center) >= np.cos(alpha)
+        candidates = np.concatenate((first, self._steps[members[in_cap]]))
+        if len(candidates) == 0:
+            return -1
+        return int(candidates.min())
+
+    def nearest_visit(self, point, k=1):
+        """
+        The 'k' trajectory points closest to 'point'
+
+        Parameters
+        ----------
+        point: array, 3, a point on (or around) the sphere
+
+        k: int, number of neighbors
+
+        Returns
+        -------
+        angles: array, k, angular distances (radians) to 'point'
+
+        steps: array of ints, k, the steps of the visits
+        """
+        self._build()
+        if self.n_points_ == 0:
+            raise ValueError('the index is empty!')
+        if self._tree is None:
+            self._tree = cKDTree(self._points)
+        k = min(int(k), self.n_points_)
+        chord, idx = self._tree.query(_unit(point)[0], k=k)
+        angles = 2*np.arcsin(np.clip(np.atleast_1d(chord)/2, 0, 1))
+        return angles, self._steps[np.atleast_1d(idx)]
+
+
+def _unit(points):
+    """helper to scale points (n x 3, or 3) onto the unit sphere"""
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    return points/np.sqrt(np.sum(points**2, axis=1))[:, np.newaxis]
@@ -121,3 +121,83 @@ def surface_cylinder(radius, height):
                                   y_blank_cylinder,
                                   z_blank_cylinder]))
     return cylinder_surface
+
+
+
+def check_random_state(seed):
+    """
+    helper to turn a seed into a np.random.RandomState instance
+
+    Parameters
+    ----------
+    seed: None, int, array of ints or RandomState
+          None returns the global RandomState used by np.random,
+          an int (or array of ints) seeds a new RandomState
+          and a RandomState is returned as is.
+          Anything else (e.g. a np.random.Generator) raises a ValueError.
+
+    Returns
+    -------
+    random_state: np.random.RandomState
+    """
+    if seed is None:
+        return np.random.mtrand._rand
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    if isinstance(seed, (int, np.integer)):
+        return np.random.RandomState(seed)
+    if isinstance(seed, (list, tuple, np.ndarray)) and len(seed) > 0 and \
+            all(isinstance(s, (int, np.integer)) for s in np.ravel(seed)):
+        return np.random.RandomState(seed)
+    raise ValueError('{0!r} cannot be used as a random_state: use None,\n\
+    an int, an array of ints or a np.random.RandomState\n\
+    (np.random.Generator is not supported)!'.format(seed))
+
+
+
+def tangent_component(points, vectors):
+    """
+    helper to project vectors onto the tangent planes
+    of a sphere (centered at the origin)
+
+    Parameters
+    ----------
+    points: array, n x 3, points on the sphere
+
+    vectors: array, n x 3, one vector attached to each point
+
+    Returns
+    -------
+    tangent: array, n x 3, the components of 'vectors'
+             orthogonal to 'points'
+    """
+    normal = points/np.sqrt(np.sum(points**2, axis=1))[:, np.newaxis]
+    return vectors - np.sum(vectors*normal, axis=1)[:, np.newaxis]*normal
+
+
+
+def geodesic_step(points, steps, radius):
+    """
+    helper to move points on a sphere along the great circles
+    given by tangent steps (the exponential map of the sphere),
+    i.e. the smoothing of a tangent plane step onto the sphere
+
+    Parameters
+    ----------
+    points: array, n x 3, points on the sphere
+
+    steps: array, n x 3, tangent vectors at 'points'
+
+    radius: float, radius of the sphere
+
+    Returns
+    -------
+    new_points: array, n x 3
+    """
+    length = np.sqrt(np.sum(steps**2, axis=1))[:, np.newaxis]
+    phi = length/radius
+    direction = steps/np.where(length > 0, length, 1)
+    new_points = np.cos(phi)*points + radius*np.sin(phi)*direction
+    # keeps rounding errors from building up over many steps
+    norm = np.sqrt(np.sum(new_points**2, axis=1))[:, np.newaxis]
+    return radius*new_points/norm
@@ -27,4 +27,9 @@ if __name__ == "__main__":
           ],
           platforms='any',
           packages=['brownian_manifold'],
+          entry_points={
+              'console_scripts': [
+                  'brownian-manifold = brownian_manifold.cli:main',
+              ],
+          },
           )